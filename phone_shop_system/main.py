@@ -1,17 +1,70 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, g
-from models import db, Brand, Model, StorageOption, Product, Device, Customer, Sale, TradeIn, Repair, User, ActivityLog, AuditLog, Lead, Delivery
-from datetime import datetime, timedelta
-from functools import wraps
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, session, g, stream_with_context
+from flask.json.provider import DefaultJSONProvider
+from flask_caching import Cache
+import orjson
+from models import db, Brand, Model, StorageOption, Product, ProductImage, Device, Customer, Sale, TradeIn, Repair, User, ActivityLog, AuditLog, Lead, Delivery, MANAGER_ROLES, normalize_imei
+from datetime import datetime, time, timedelta, timezone
+from functools import lru_cache, wraps
+from argon2 import PasswordHasher
+from argon2.exceptions import VerifyMismatchError, InvalidHashError
+from sqlalchemy import event
+from sqlalchemy.orm import raiseload, selectinload
+from werkzeug.security import check_password_hash
+import atexit
+import hmac
 import os
+import queue
+import threading
+
+class ORJSONProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///phone_shop.db')
+app.json = ORJSONProvider(app)
+database_url = os.environ.get('DATABASE_URL', 'sqlite:///phone_shop.db')
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'ariotech-secret-key-2024')
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+
+engine_options = {'query_cache_size': 1200, 'insertmanyvalues_page_size': 5000}
+if database_url.startswith('sqlite'):
+    engine_options['connect_args'] = {'check_same_thread': False}
+else:
+    engine_options.update({
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 20)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 40)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+        'pool_timeout': 30,
+        'pool_use_lifo': True,
+        'executemany_mode': 'values_plus_batch'
+    })
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options
+replica_url = os.environ.get('REPLICA_URL')
+if replica_url:
+    app.config['SQLALCHEMY_BINDS'] = {'reports': replica_url}
 db.init_app(app)
 
+def reports_engine():
+    return db.engines['reports'] if replica_url else db.engine
+cache = Cache(app, config={'CACHE_TYPE': 'SimpleCache'})
+
+@lru_cache(maxsize=4096)
+def _cached_url_for(endpoint, values_items):
+    return url_for(endpoint, **dict(values_items))
+
+def cached_url_for(endpoint, **values):
+    if '_external' in values or '_scheme' in values:
+        return url_for(endpoint, **values)
+    return _cached_url_for(endpoint, tuple(sorted(values.items())))
+
+app.jinja_env.globals['url_for'] = cached_url_for
+
 @app.context_processor
 def inject_globals():
     return {
@@ -19,22 +72,135 @@ def inject_globals():
         'current_user': g.get('current_user')
     }
 
+ph = PasswordHasher(time_cost=2, memory_cost=64 * 1024, parallelism=1)
+
 def hash_password(password):
-    return generate_password_hash(password, method='pbkdf2:sha256')
+    return ph.hash(password)
+
+def verify_password(stored_hash, password):
+    if stored_hash.startswith('$argon2'):
+        try:
+            ph.verify(stored_hash, password)
+        except (VerifyMismatchError, InvalidHashError):
+            return False, None
+        if ph.check_needs_rehash(stored_hash):
+            return True, ph.hash(password)
+        return True, None
+    if check_password_hash(stored_hash, password):
+        return True, ph.hash(password)
+    return False, None
+
+def ojson(obj):
+    return Response(orjson.dumps(obj), mimetype='application/json')
+
+def today_range():
+    start = datetime.combine(datetime.now().date(), time.min)
+    return start, start + timedelta(days=1)
+
+def guarded(*eager):
+    opts = list(eager)
+    if app.debug:
+        opts.append(raiseload('*'))
+    return opts
+
+def document_number(prefix, row_id):
+    return f"{prefix}-{10000 + row_id:05d}"
+
+activity_queue = queue.Queue()
+
+def _flush_activity(rows):
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(ActivityLog.__table__.insert(), rows)
+
+def _activity_worker():
+    while True:
+        rows = [activity_queue.get()]
+        while len(rows) < 500:
+            try:
+                rows.append(activity_queue.get(timeout=0.05))
+            except queue.Empty:
+                break
+        try:
+            _flush_activity(rows)
+        except Exception:
+            app.logger.exception('Failed to flush %d activity log rows', len(rows))
+
+def _drain_activity_queue():
+    rows = []
+    while True:
+        try:
+            rows.append(activity_queue.get_nowait())
+        except queue.Empty:
+            break
+    if rows:
+        try:
+            _flush_activity(rows)
+        except Exception:
+            app.logger.exception('Failed to flush %d activity log rows at shutdown', len(rows))
+
+threading.Thread(target=_activity_worker, daemon=True).start()
+atexit.register(_drain_activity_queue)
 
 def log_activity(action, entity_type=None, entity_id=None, details=None):
     if 'user_id' in session:
-        activity = ActivityLog(
-            user_id=session.get('user_id'),
-            user_name=session.get('name'),
-            action=action,
-            entity_type=entity_type,
-            entity_id=entity_id,
-            details=details,
-            ip_address=request.remote_addr
-        )
-        db.session.add(activity)
-        db.session.commit()
+        activity_queue.put({
+            'user_id': session.get('user_id'),
+            'user_name': session.get('name'),
+            'action': action,
+            'entity_type': entity_type,
+            'entity_id': entity_id,
+            'details': details,
+            'ip_address': request.remote_addr,
+            'timestamp': datetime.now(timezone.utc)
+        })
+
+USER_CACHE_TTL = 30
+
+def load_current_user(user_id):
+    cached = cache.get(f'user:{user_id}')
+    if cached is None:
+        row = db.session.execute(db.select(
+            User.id, User.username, User.name, User.role, User.is_active
+        ).where(User.id == user_id)).first()
+        if row is None:
+            return None
+        cached = dict(row._mapping)
+        cache.set(f'user:{user_id}', cached, timeout=USER_CACHE_TTL)
+    return User(**cached)
+
+LAST_SEEN_FLUSH_SECONDS = int(os.environ.get('LAST_SEEN_FLUSH_SECONDS', 60))
+
+_last_seen = {}
+_last_seen_lock = threading.Lock()
+_last_seen_sleeper = threading.Event()
+
+def _flush_last_seen():
+    with _last_seen_lock:
+        pending = dict(_last_seen)
+        _last_seen.clear()
+    if not pending:
+        return
+    rows = [{'u_id': uid, 'ts': ts} for uid, ts in pending.items()]
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(
+                User.__table__.update()
+                .where(User.__table__.c.id == db.bindparam('u_id'))
+                .values(last_activity=db.bindparam('ts')),
+                rows
+            )
+
+def _last_seen_worker():
+    while True:
+        _last_seen_sleeper.wait(LAST_SEEN_FLUSH_SECONDS)
+        try:
+            _flush_last_seen()
+        except Exception:
+            app.logger.exception('Failed to flush last_activity updates')
+
+threading.Thread(target=_last_seen_worker, daemon=True).start()
+atexit.register(_flush_last_seen)
 
 def login_required(f):
     @wraps(f)
@@ -43,12 +209,12 @@ def login_required(f):
             if request.is_json:
                 return jsonify({'error': 'Authentication required'}), 401
             return redirect(url_for('login'))
-        user = User.query.get(session['user_id'])
+        user = load_current_user(session['user_id'])
         if not user or not user.is_active:
             session.clear()
             return redirect(url_for('login'))
-        user.last_activity = datetime.utcnow()
-        db.session.commit()
+        with _last_seen_lock:
+            _last_seen[user.id] = datetime.now(timezone.utc)
         g.current_user = user
         return f(*args, **kwargs)
     return decorated_function
@@ -70,27 +236,20 @@ def manager_required(f):
     def decorated_function(*args, **kwargs):
         if 'user_id' not in session:
             return redirect(url_for('login'))
-        if session.get('role') not in ['owner', 'manager']:
+        if session.get('role') not in MANAGER_ROLES:
             if request.is_json:
                 return jsonify({'error': 'Manager access required'}), 403
             return render_template('error.html', message='Access denied. Manager privileges required.'), 403
         return f(*args, **kwargs)
     return decorated_function
 
-@app.before_request
-def create_tables():
-    if not hasattr(app, '_db_initialized'):
-        db.create_all()
-        seed_data()
-        app._db_initialized = True
-
 def seed_data():
     if Brand.query.count() == 0:
         apple = Brand(name="Apple")
         samsung = Brand(name="Samsung")
         google = Brand(name="Google")
         db.session.add_all([apple, samsung, google])
-        db.session.commit()
+        db.session.flush()
         
         iphone_models = [
             "iPhone 16 Pro Max", "iPhone 16 Pro", "iPhone 16 Plus", "iPhone 16",
@@ -100,59 +259,143 @@ def seed_data():
             "iPhone 12 Pro Max", "iPhone 12 Pro", "iPhone 12", "iPhone 12 Mini",
             "iPhone SE (3rd Gen)", "iPhone 11 Pro Max", "iPhone 11 Pro", "iPhone 11"
         ]
-        for i, name in enumerate(iphone_models):
-            db.session.add(Model(name=name, brand_id=apple.id, order_index=len(iphone_models)-i))
-        
         samsung_models = [
             "Galaxy S24 Ultra", "Galaxy S24+", "Galaxy S24",
             "Galaxy S23 Ultra", "Galaxy S23+", "Galaxy S23",
             "Galaxy Z Fold5", "Galaxy Z Flip5", "Galaxy A54"
         ]
-        for i, name in enumerate(samsung_models):
-            db.session.add(Model(name=name, brand_id=samsung.id, order_index=len(samsung_models)-i))
-        
         google_models = ["Pixel 8 Pro", "Pixel 8", "Pixel 7 Pro", "Pixel 7", "Pixel 7a"]
-        for i, name in enumerate(google_models):
-            db.session.add(Model(name=name, brand_id=google.id, order_index=len(google_models)-i))
-        
-        db.session.commit()
-        
-        for model in Model.query.all():
-            if "Pro" in model.name or "Ultra" in model.name:
+
+        model_rows = []
+        for brand, names in ((apple, iphone_models), (samsung, samsung_models), (google, google_models)):
+            model_rows.extend(
+                {"name": name, "brand_id": brand.id, "order_index": len(names) - i}
+                for i, name in enumerate(names)
+            )
+        db.session.bulk_insert_mappings(Model, model_rows)
+
+        storage_rows = []
+        for model_id, name in db.session.execute(db.select(Model.id, Model.name)):
+            if "Pro" in name or "Ultra" in name:
                 sizes = ["256GB", "512GB", "1TB"]
-            elif "Mini" in model.name or "SE" in model.name:
+            elif "Mini" in name or "SE" in name:
                 sizes = ["64GB", "128GB", "256GB"]
             else:
                 sizes = ["128GB", "256GB", "512GB"]
-            for size in sizes:
-                db.session.add(StorageOption(model_id=model.id, size=size))
-        
-        db.session.commit()
-    
+            storage_rows.extend({"model_id": model_id, "size": size} for size in sizes)
+        db.session.bulk_insert_mappings(StorageOption, storage_rows)
+
     if User.query.count() == 0:
         owner = User(
             username="owner",
-            password_hash=generate_password_hash("owner123", method='pbkdf2:sha256'),
+            password_hash=hash_password("owner123"),
             pin="1234",
             name="Shop Owner",
             role="owner"
         )
         manager = User(
             username="manager",
-            password_hash=generate_password_hash("manager123", method='pbkdf2:sha256'),
+            password_hash=hash_password("manager123"),
             pin="5678",
             name="Store Manager",
             role="manager"
         )
         staff = User(
             username="staff",
-            password_hash=generate_password_hash("staff123", method='pbkdf2:sha256'),
+            password_hash=hash_password("staff123"),
             pin="0000",
             name="Sales Staff",
             role="staff"
         )
         db.session.add_all([owner, manager, staff])
-        db.session.commit()
+
+    db.session.commit()
+
+MATVIEW_REFRESH_SECONDS = 300
+
+SALES_MATVIEWS = {
+    'mv_sales_daily':
+        "SELECT date_trunc('day', created_at) AS day, created_by, "
+        "SUM(total_price) AS revenue, SUM(profit) AS profit, COUNT(*) AS sales_count "
+        "FROM sale GROUP BY 1, 2",
+    'mv_profit_by_user':
+        "SELECT created_by, SUM(total_price) AS revenue, SUM(profit) AS profit, "
+        "COUNT(*) AS sales_count FROM sale GROUP BY 1"
+}
+
+def init_matviews():
+    with db.engine.begin() as conn:
+        for name, query in SALES_MATVIEWS.items():
+            conn.execute(db.text(f'CREATE MATERIALIZED VIEW IF NOT EXISTS {name} AS {query}'))
+        conn.execute(db.text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_mv_sales_daily ON mv_sales_daily (day, created_by)'))
+        conn.execute(db.text(
+            'CREATE UNIQUE INDEX IF NOT EXISTS ix_mv_profit_by_user ON mv_profit_by_user (created_by)'))
+
+MATVIEW_LOCK_KEY = 873201
+
+def refresh_matviews():
+    with app.app_context():
+        with db.engine.begin() as conn:
+            if not conn.execute(db.text(
+                    'SELECT pg_try_advisory_xact_lock(:key)'), {'key': MATVIEW_LOCK_KEY}).scalar():
+                return
+            for name in SALES_MATVIEWS:
+                conn.execute(db.text(f'REFRESH MATERIALIZED VIEW CONCURRENTLY {name}'))
+
+def _matview_worker():
+    while True:
+        threading.Event().wait(MATVIEW_REFRESH_SECONDS)
+        try:
+            refresh_matviews()
+        except Exception:
+            app.logger.exception('Failed to refresh materialized views')
+
+LOG_RETENTION_DAYS = int(os.environ.get('LOG_RETENTION_DAYS', 365))
+
+def purge_old_logs(days=None):
+    cutoff = datetime.now(timezone.utc) - timedelta(days=LOG_RETENTION_DAYS if days is None else days)
+    with app.app_context():
+        with db.engine.begin() as conn:
+            conn.execute(db.delete(ActivityLog).where(ActivityLog.timestamp < cutoff))
+            conn.execute(db.delete(AuditLog).where(AuditLog.timestamp < cutoff))
+
+LOG_PURGE_INTERVAL_SECONDS = 86400
+
+def _log_purge_worker():
+    while True:
+        threading.Event().wait(LOG_PURGE_INTERVAL_SECONDS)
+        try:
+            purge_old_logs()
+        except Exception:
+            app.logger.exception('Failed to purge old log rows')
+
+threading.Thread(target=_log_purge_worker, daemon=True).start()
+
+def init_db():
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            @event.listens_for(db.engine, 'connect')
+            def _set_sqlite_pragmas(dbapi_conn, _connection_record):
+                cursor = dbapi_conn.cursor()
+                cursor.execute('PRAGMA journal_mode=WAL')
+                cursor.execute('PRAGMA synchronous=NORMAL')
+                cursor.execute('PRAGMA cache_size=-65536')
+                cursor.execute('PRAGMA mmap_size=268435456')
+                cursor.execute('PRAGMA temp_store=MEMORY')
+                cursor.close()
+        db.create_all()
+        seed_data()
+        if db.engine.dialect.name == 'postgresql':
+            with db.engine.begin() as conn:
+                conn.execute(db.text(
+                    'CREATE INDEX IF NOT EXISTS ix_activity_ts_brin ON activity_log USING brin (timestamp)'))
+                conn.execute(db.text(
+                    'CREATE INDEX IF NOT EXISTS ix_audit_ts_brin ON audit_log USING brin (timestamp)'))
+            init_matviews()
+            threading.Thread(target=_matview_worker, daemon=True).start()
+
+init_db()
 
 @app.route('/')
 def index():
@@ -167,24 +410,30 @@ def login():
         password = request.form.get('password', '').strip()
         pin = request.form.get('pin', '').strip()
         
-        user = User.query.filter_by(username=username, is_active=True).first()
-        
-        if user:
+        row = db.session.execute(db.select(
+            User.id, User.username, User.name, User.role, User.pin, User.password_hash
+        ).where(User.username == username, User.is_active == True)).first()
+
+        if row:
             auth_valid = False
-            if password and check_password_hash(user.password_hash, password):
-                auth_valid = True
-            elif pin and user.pin == pin:
+            new_hash = None
+            if password:
+                auth_valid, new_hash = verify_password(row.password_hash, password)
+            if not auth_valid and pin and row.pin and hmac.compare_digest(row.pin, pin):
                 auth_valid = True
-            
+
             if auth_valid:
                 session.permanent = True
-                session['user_id'] = user.id
-                session['username'] = user.username
-                session['name'] = user.name
-                session['role'] = user.role
-                user.last_activity = datetime.utcnow()
-                db.session.commit()
+                session['user_id'] = row.id
+                session['username'] = row.username
+                session['name'] = row.name
+                session['role'] = row.role
+                values = {'last_activity': datetime.now(timezone.utc)}
+                if new_hash:
+                    values['password_hash'] = new_hash
+                db.session.execute(db.update(User).where(User.id == row.id).values(**values))
                 log_activity('login', details='User logged in successfully')
+                db.session.commit()
                 return redirect(url_for('dashboard'))
         
         return render_template('login.html', error='Invalid credentials. Please try again.')
@@ -201,51 +450,55 @@ def logout():
 @login_required
 def dashboard():
     user = g.current_user
-    today = datetime.now().date()
+    start, end = today_range()
     
     if user.role == 'owner':
-        sales = Sale.query.order_by(Sale.created_at.desc()).limit(10).all()
+        sales = Sale.query.options(*guarded(selectinload(Sale.product), selectinload(Sale.creator))).order_by(Sale.created_at.desc()).limit(10).all()
         tradeins = TradeIn.query.filter_by(status='pending').all()
         repairs = Repair.query.filter(Repair.status != 'completed').all()
-        leads = Lead.query.filter(Lead.status.in_(['new', 'contacted', 'follow_up'])).all()
+        leads = Lead.query.options(*guarded()).filter(Lead.status.in_(['new', 'contacted', 'follow_up'])).all()
         deliveries = Delivery.query.filter(Delivery.status != 'completed').all()
         
-        sales_today = Sale.query.filter(db.func.date(Sale.created_at) == today).all()
-        total_revenue = sum(s.total_price for s in sales_today)
-        total_profit = sum(s.profit for s in sales_today if s.profit)
-        
+        total_revenue, total_profit, sales_count = db.session.execute(db.select(
+            db.func.coalesce(db.func.sum(Sale.total_price), 0),
+            db.func.coalesce(db.func.sum(Sale.profit), 0),
+            db.func.count(Sale.id)
+        ).where(Sale.created_at >= start, Sale.created_at < end)).one()
+
         staff_sales = db.session.query(
             User.name,
             db.func.count(Sale.id).label('count'),
             db.func.sum(Sale.total_price).label('total')
         ).join(Sale, Sale.created_by == User.id).filter(
-            db.func.date(Sale.created_at) == today
+            Sale.created_at >= start, Sale.created_at < end
         ).group_by(User.id).all()
         
     elif user.role == 'manager':
-        sales = Sale.query.order_by(Sale.created_at.desc()).limit(10).all()
+        sales = Sale.query.options(*guarded(selectinload(Sale.product), selectinload(Sale.creator))).order_by(Sale.created_at.desc()).limit(10).all()
         tradeins = TradeIn.query.filter_by(status='pending').all()
         repairs = Repair.query.filter(Repair.status != 'completed').all()
-        leads = Lead.query.filter(Lead.status.in_(['new', 'contacted', 'follow_up'])).all()
+        leads = Lead.query.options(*guarded()).filter(Lead.status.in_(['new', 'contacted', 'follow_up'])).all()
         deliveries = Delivery.query.filter(Delivery.status != 'completed').all()
         
-        sales_today = Sale.query.filter(db.func.date(Sale.created_at) == today).all()
-        total_revenue = sum(s.total_price for s in sales_today)
+        total_revenue, sales_count = db.session.execute(db.select(
+            db.func.coalesce(db.func.sum(Sale.total_price), 0),
+            db.func.count(Sale.id)
+        ).where(Sale.created_at >= start, Sale.created_at < end)).one()
         total_profit = None
         staff_sales = []
         
     else:
-        sales = Sale.query.filter_by(created_by=user.id).order_by(Sale.created_at.desc()).limit(10).all()
+        sales = Sale.query.options(*guarded(selectinload(Sale.product), selectinload(Sale.creator))).filter_by(created_by=user.id).order_by(Sale.created_at.desc()).limit(10).all()
         tradeins = TradeIn.query.filter_by(created_by=user.id, status='pending').all()
         repairs = Repair.query.filter_by(created_by=user.id).filter(Repair.status != 'completed').all()
-        leads = Lead.query.filter_by(created_by=user.id).filter(Lead.status.in_(['new', 'contacted', 'follow_up'])).all()
+        leads = Lead.query.options(*guarded()).filter_by(created_by=user.id).filter(Lead.status.in_(['new', 'contacted', 'follow_up'])).all()
         deliveries = []
         
-        sales_today = Sale.query.filter(
-            Sale.created_by == user.id,
-            db.func.date(Sale.created_at) == today
-        ).all()
-        total_revenue = sum(s.total_price for s in sales_today)
+        total_revenue, sales_count = db.session.execute(db.select(
+            db.func.coalesce(db.func.sum(Sale.total_price), 0),
+            db.func.count(Sale.id)
+        ).where(Sale.created_by == user.id,
+                Sale.created_at >= start, Sale.created_at < end)).one()
         total_profit = None
         staff_sales = []
     
@@ -258,7 +511,7 @@ def dashboard():
         total_revenue=total_revenue,
         total_profit=total_profit,
         staff_sales=staff_sales,
-        sales_count=len(sales_today)
+        sales_count=sales_count
     )
 
 @app.route('/leads')
@@ -266,9 +519,9 @@ def dashboard():
 def leads_list():
     user = g.current_user
     if user.can_view_all_leads():
-        leads = Lead.query.order_by(Lead.created_at.desc()).all()
+        leads = Lead.query.options(*guarded()).order_by(Lead.created_at.desc()).all()
     else:
-        leads = Lead.query.filter_by(created_by=user.id).order_by(Lead.created_at.desc()).all()
+        leads = Lead.query.options(*guarded()).filter_by(created_by=user.id).order_by(Lead.created_at.desc()).all()
     return render_template('leads.html', leads=leads)
 
 @app.route('/leads/add', methods=['GET', 'POST'])
@@ -276,9 +529,7 @@ def leads_list():
 def add_lead():
     if request.method == 'POST':
         data = request.form
-        count = Lead.query.count()
         lead = Lead(
-            lead_number=f"LD-{str(10001 + count).zfill(5)}",
             customer_name=data.get('customer_name'),
             customer_phone=data.get('customer_phone'),
             customer_email=data.get('customer_email'),
@@ -289,28 +540,44 @@ def add_lead():
             assigned_to=session.get('user_id')
         )
         db.session.add(lead)
+        db.session.flush()
+        lead.lead_number = document_number('LD', lead.id)
         db.session.commit()
         log_activity('lead_created', 'lead', lead.id, f'Lead {lead.lead_number} created')
         return redirect(url_for('leads_list'))
     return render_template('add_lead.html')
 
+@cache.cached(timeout=300, key_prefix='active_brand_rows')
+def active_brand_rows():
+    return db.session.execute(db.select(Brand.id, Brand.name).where(Brand.is_active == True)).all()
+
+@cache.cached(timeout=300, key_prefix='active_product_rows')
+def active_product_rows():
+    return db.session.execute(
+        db.select(Product.id, Product.name, Product.price).where(Product.is_active == True)
+    ).all()
+
+def _invalidate_catalog_cache(_mapper, _connection, _target):
+    cache.delete_many('active_brand_rows', 'active_product_rows', 'view//api/brands')
+
+for _model in (Brand, Model, StorageOption, Product):
+    for _event_name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(_model, _event_name, _invalidate_catalog_cache)
+
 @app.route('/tradein')
 @login_required
 def tradein():
-    brands = Brand.query.filter_by(is_active=True).all()
-    return render_template('tradein_wizard.html', brands=brands)
+    return render_template('tradein_wizard.html', brands=active_brand_rows())
 
 @app.route('/sales')
 @login_required
 def sales_form():
-    products = Product.query.filter_by(is_active=True).all()
-    return render_template('sales_form.html', products=products)
+    return render_template('sales_form.html', products=active_product_rows())
 
 @app.route('/repairs')
 @login_required
 def repairs_form():
-    brands = Brand.query.filter_by(is_active=True).all()
-    return render_template('repair_form.html', brands=brands)
+    return render_template('repair_form.html', brands=active_brand_rows())
 
 @app.route('/staff')
 @owner_required
@@ -350,6 +617,7 @@ def toggle_staff(user_id):
         return jsonify({'error': 'Cannot deactivate yourself'}), 400
     user.is_active = not user.is_active
     db.session.commit()
+    cache.delete(f'user:{user.id}')
     log_activity('staff_toggled', 'user', user.id, f'Staff {user.name} {"activated" if user.is_active else "deactivated"}')
     return jsonify({'success': True, 'is_active': user.is_active})
 
@@ -359,17 +627,26 @@ def owner_dashboard():
     today = datetime.now().date()
     week_ago = today - timedelta(days=7)
     
-    staff_performance = db.session.query(
-        User.id,
-        User.name,
-        User.role,
-        db.func.count(Sale.id).label('sales_count'),
-        db.func.sum(Sale.total_price).label('total_sales'),
-        db.func.sum(Sale.profit).label('total_profit')
-    ).outerjoin(Sale, Sale.created_by == User.id).filter(
-        User.role.in_(['staff', 'manager']),
-        User.is_active == True
-    ).group_by(User.id).all()
+    if db.engine.dialect.name == 'postgresql':
+        staff_performance = db.session.execute(db.text(
+            'SELECT u.id, u.name, u.role, '
+            'COALESCE(m.sales_count, 0) AS sales_count, '
+            'm.revenue AS total_sales, m.profit AS total_profit '
+            'FROM "user" u LEFT JOIN mv_profit_by_user m ON m.created_by = u.id '
+            "WHERE u.role IN ('staff', 'manager') AND u.is_active"
+        )).all()
+    else:
+        staff_performance = db.session.query(
+            User.id,
+            User.name,
+            User.role,
+            db.func.count(Sale.id).label('sales_count'),
+            db.func.sum(Sale.total_price).label('total_sales'),
+            db.func.sum(Sale.profit).label('total_profit')
+        ).outerjoin(Sale, Sale.created_by == User.id).filter(
+            User.role.in_(['staff', 'manager']),
+            User.is_active == True
+        ).group_by(User.id).all()
     
     leads_stats = db.session.query(
         User.name,
@@ -379,15 +656,18 @@ def owner_dashboard():
         User.role.in_(['staff', 'manager'])
     ).group_by(User.id).all()
     
-    overdue_followups = Lead.query.filter(
-        Lead.follow_up_date < datetime.now(),
-        Lead.status.in_(['new', 'contacted', 'follow_up'])
-    ).count()
-    
-    pending_deliveries = Delivery.query.filter_by(status='pending').count()
-    failed_deliveries = Delivery.query.filter_by(status='failed').count()
+    overdue_followups, pending_deliveries, failed_deliveries = db.session.execute(db.select(
+        db.select(db.func.count(Lead.id)).where(
+            Lead.follow_up_date < datetime.now(),
+            Lead.status.in_(['new', 'contacted', 'follow_up'])
+        ).scalar_subquery(),
+        db.select(db.func.count(Delivery.id)).where(Delivery.status == 'pending').scalar_subquery(),
+        db.select(db.func.count(Delivery.id)).where(Delivery.status == 'failed').scalar_subquery()
+    )).one()
     
-    recent_activities = ActivityLog.query.order_by(ActivityLog.timestamp.desc()).limit(50).all()
+    recent_activities = ActivityLog.query.options(
+        db.undefer(ActivityLog.details)
+    ).order_by(ActivityLog.timestamp.desc()).limit(50).all()
     
     return render_template('owner_dashboard.html',
         staff_performance=staff_performance,
@@ -405,54 +685,75 @@ def admin_models():
     models = Model.query.order_by(Model.order_index.desc()).all()
     return render_template('admin_models.html', brands=brands, models=models)
 
+CATALOG_CACHE_CONTROL = 'public, max-age=300, stale-while-revalidate=600'
+
+def catalog_json(items):
+    resp = ojson(items)
+    resp.headers['Cache-Control'] = CATALOG_CACHE_CONTROL
+    return resp
+
+BRANDS_STMT = db.select(Brand.id, Brand.name).where(Brand.is_active == True)
+MODELS_STMT = db.select(Model.id, Model.name).where(
+    Model.brand_id == db.bindparam('brand_id'), Model.is_active == True
+).order_by(Model.order_index.desc())
+STORAGES_STMT = db.select(StorageOption.id, StorageOption.size).where(
+    StorageOption.model_id == db.bindparam('model_id'), StorageOption.is_active == True
+)
+
 @app.route('/api/brands')
+@cache.cached(timeout=300)
 def get_brands():
-    brands = Brand.query.filter_by(is_active=True).all()
-    return jsonify([{"id": b.id, "name": b.name} for b in brands])
+    rows = db.session.execute(BRANDS_STMT).all()
+    return catalog_json([{"id": i, "name": n} for i, n in rows])
 
 @app.route('/api/models')
+@cache.cached(timeout=300, query_string=True)
 def get_models():
     brand_id = request.args.get('brand_id') or request.args.get('brand')
     if not brand_id:
         return jsonify([])
-    models = Model.query.filter_by(brand_id=brand_id, is_active=True).order_by(Model.order_index.desc()).all()
-    return jsonify([{"id": m.id, "name": m.name} for m in models])
+    rows = db.session.execute(MODELS_STMT, {"brand_id": brand_id}).all()
+    return catalog_json([{"id": i, "name": n} for i, n in rows])
 
 @app.route('/api/storages')
+@cache.cached(timeout=300, query_string=True)
 def get_storages():
     model_id = request.args.get('model_id')
     if not model_id:
         return jsonify([])
-    storages = StorageOption.query.filter_by(model_id=model_id, is_active=True).all()
-    return jsonify([{"id": s.id, "size": s.size} for s in storages])
+    rows = db.session.execute(STORAGES_STMT, {"model_id": model_id}).all()
+    return catalog_json([{"id": i, "size": s} for i, s in rows])
 
 @app.route('/api/validate-serial')
 def validate_serial():
     serial = request.args.get('serial')
     if not serial:
         return jsonify({"valid": False, "error": "Serial required"})
-    exists = Device.query.filter_by(imei_or_serial=serial).first()
-    tradein_exists = TradeIn.query.filter_by(imei=serial).first()
+    norm = normalize_imei(serial)
+    if norm is not None:
+        dup_expr = (db.select(Device.id).where(Device.imei_norm == norm).exists() |
+                    db.select(TradeIn.id).where(TradeIn.imei_norm == norm).exists())
+    else:
+        dup_expr = (db.select(Device.id).where(Device.imei_or_serial == serial).exists() |
+                    db.select(TradeIn.id).where(TradeIn.imei == serial).exists())
+    is_duplicate = db.session.execute(db.select(dup_expr)).scalar()
     return jsonify({
         "valid": True,
-        "is_duplicate": exists is not None or tradein_exists is not None,
-        "warning": "Device already in system" if exists or tradein_exists else None
+        "is_duplicate": bool(is_duplicate),
+        "warning": "Device already in system" if is_duplicate else None
     })
 
 @app.route('/api/tradein', methods=['POST'])
 @login_required
 def submit_tradein():
     data = request.json or request.form
-    count = TradeIn.query.count()
-    trade_in_number = f"TI-{str(10001 + count).zfill(5)}"
-    
-    tradein = TradeIn(
-        trade_in_number=trade_in_number,
+    tradein_id = db.session.execute(db.insert(TradeIn).values(
         brand=data.get('brand'),
         model=data.get('model'),
         storage=data.get('storage'),
         color=data.get('color'),
         imei=data.get('imei'),
+        imei_norm=normalize_imei(data.get('imei')),
         serial_number=data.get('serial_number'),
         customer_name=data.get('customer_name'),
         customer_phone=data.get('customer_phone'),
@@ -462,52 +763,46 @@ def submit_tradein():
         calculated_offer=float(data.get('calculated_offer', 0)),
         status='pending',
         created_by=session.get('user_id')
-    )
-    db.session.add(tradein)
+    ).returning(TradeIn.id)).scalar_one()
+    trade_in_number = document_number('TI', tradein_id)
+    db.session.execute(db.update(TradeIn).where(TradeIn.id == tradein_id).values(trade_in_number=trade_in_number))
+    log_activity('tradein_created', 'tradein', tradein_id, f'Trade-in {trade_in_number} created')
     db.session.commit()
-    log_activity('tradein_created', 'tradein', tradein.id, f'Trade-in {trade_in_number} created')
-    
-    return jsonify({"success": True, "trade_in_number": trade_in_number, "id": tradein.id})
+    bump_stats_version()
+
+    return jsonify({"success": True, "trade_in_number": trade_in_number, "id": tradein_id})
 
 @app.route('/api/sale', methods=['POST'])
 @login_required
 def submit_sale():
     data = request.json or request.form
-    count = Sale.query.count()
     quantity = int(data.get('quantity', 1))
     unit_price = float(data.get('unit_price', 0))
     cost_price = float(data.get('cost_price', 0))
     total = quantity * unit_price
-    profit = total - (quantity * cost_price) if cost_price else 0
-    
-    sale = Sale(
-        sale_number=f"SL-{str(10001 + count).zfill(5)}",
+
+    sale_id = db.session.execute(db.insert(Sale).values(
         product_id=data.get('product_id') if data.get('product_id') else None,
         other_product_name=data.get('other_product_name'),
         quantity=quantity,
         unit_price=unit_price,
         cost_price=cost_price,
-        total_price=total,
-        profit=profit,
         payment_method=data.get('payment_method'),
-        created_by=session.get('user_id'),
-        created_at=datetime.now()
-    )
-    db.session.add(sale)
+        created_by=session.get('user_id')
+    ).returning(Sale.id)).scalar_one()
+    sale_number = document_number('SL', sale_id)
+    db.session.execute(db.update(Sale).where(Sale.id == sale_id).values(sale_number=sale_number))
+    log_activity('sale_created', 'sale', sale_id, f'Sale {sale_number} for ${total}')
     db.session.commit()
-    log_activity('sale_created', 'sale', sale.id, f'Sale {sale.sale_number} for ${total}')
-    
-    return jsonify({"success": True, "sale_id": sale.id, "sale_number": sale.sale_number})
+    bump_stats_version()
+
+    return jsonify({"success": True, "sale_id": sale_id, "sale_number": sale_number})
 
 @app.route('/api/repair', methods=['POST'])
 @login_required
 def submit_repair():
     data = request.json or request.form
-    count = Repair.query.count()
-    repair_number = f"RP-{str(10001 + count).zfill(5)}"
-    
-    repair = Repair(
-        repair_number=repair_number,
+    repair_id = db.session.execute(db.insert(Repair).values(
         device_brand=data.get('brand'),
         device_model=data.get('model'),
         device_serial=data.get('serial'),
@@ -516,12 +811,14 @@ def submit_repair():
         issue_description=data.get('issue_description'),
         status='received',
         created_by=session.get('user_id')
-    )
-    db.session.add(repair)
+    ).returning(Repair.id)).scalar_one()
+    repair_number = document_number('RP', repair_id)
+    db.session.execute(db.update(Repair).where(Repair.id == repair_id).values(repair_number=repair_number))
+    log_activity('repair_created', 'repair', repair_id, f'Repair {repair_number} created')
     db.session.commit()
-    log_activity('repair_created', 'repair', repair.id, f'Repair {repair_number} created')
-    
-    return jsonify({"success": True, "repair_number": repair_number, "id": repair.id})
+    bump_stats_version()
+
+    return jsonify({"success": True, "repair_number": repair_number, "id": repair_id})
 
 @app.route('/receipt/<int:sale_id>')
 @login_required
@@ -530,53 +827,58 @@ def receipt(sale_id):
     user = g.current_user
     if user.role == 'staff' and sale.created_by != user.id:
         return render_template('error.html', message='Access denied'), 403
-    creator = User.query.get(sale.created_by) if sale.created_by else None
-    return render_template('receipt.html', sale=sale, creator=creator)
+    return render_template('receipt.html', sale=sale, creator=sale.creator)
+
+def stats_version():
+    return cache.get('stats_ver') or 0
+
+def bump_stats_version():
+    cache.set('stats_ver', stats_version() + 1, timeout=0)
 
 @app.route('/api/dashboard-stats')
 @login_required
 def dashboard_stats():
     user = g.current_user
-    today = datetime.now().date()
-    
-    if user.role == 'owner':
-        sales_today = Sale.query.filter(db.func.date(Sale.created_at) == today).all()
-        total_sales = sum(s.total_price for s in sales_today)
-        total_profit = sum(s.profit for s in sales_today if s.profit)
-        pending_tradeins = TradeIn.query.filter_by(status='pending').count()
-        active_repairs = Repair.query.filter(Repair.status != 'completed').count()
-    elif user.role == 'manager':
-        sales_today = Sale.query.filter(db.func.date(Sale.created_at) == today).all()
-        total_sales = sum(s.total_price for s in sales_today)
-        total_profit = None
-        pending_tradeins = TradeIn.query.filter_by(status='pending').count()
-        active_repairs = Repair.query.filter(Repair.status != 'completed').count()
-    else:
-        sales_today = Sale.query.filter(
-            Sale.created_by == user.id,
-            db.func.date(Sale.created_at) == today
-        ).all()
-        total_sales = sum(s.total_price for s in sales_today)
-        total_profit = None
-        pending_tradeins = TradeIn.query.filter_by(created_by=user.id, status='pending').count()
-        active_repairs = Repair.query.filter_by(created_by=user.id).filter(Repair.status != 'completed').count()
-    
+    cache_key = f"stats:{user.role}:{user.id}:{stats_version()}"
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return ojson(cached)
+
+    start, end = today_range()
+
+    sales_where = [Sale.created_at >= start, Sale.created_at < end]
+    tradein_where = [TradeIn.status == 'pending']
+    repair_where = [Repair.status != 'completed']
+    if user.role not in MANAGER_ROLES:
+        sales_where.append(Sale.created_by == user.id)
+        tradein_where.append(TradeIn.created_by == user.id)
+        repair_where.append(Repair.created_by == user.id)
+
+    total_sales, sales_count, total_profit, pending_tradeins, active_repairs = db.session.execute(db.select(
+        db.select(db.func.coalesce(db.func.sum(Sale.total_price), 0)).where(*sales_where).scalar_subquery(),
+        db.select(db.func.count(Sale.id)).where(*sales_where).scalar_subquery(),
+        db.select(db.func.coalesce(db.func.sum(Sale.profit), 0)).where(*sales_where).scalar_subquery(),
+        db.select(db.func.count(TradeIn.id)).where(*tradein_where).scalar_subquery(),
+        db.select(db.func.count(Repair.id)).where(*repair_where).scalar_subquery()
+    )).one()
+
     response = {
-        "sales_today": total_sales,
-        "sales_count": len(sales_today),
+        "sales_today": float(total_sales),
+        "sales_count": sales_count,
         "pending_tradeins": pending_tradeins,
         "active_repairs": active_repairs
     }
-    if total_profit is not None:
-        response["profit_today"] = total_profit
-    
-    return jsonify(response)
+    if user.role == 'owner':
+        response["profit_today"] = float(total_profit)
+
+    cache.set(cache_key, response, timeout=15)
+    return ojson(response)
 
 @app.route('/api/staff-performance')
 @owner_required
 def staff_performance_api():
-    today = datetime.now().date()
-    
+    start, end = today_range()
+
     performance = db.session.query(
         User.id,
         User.name,
@@ -586,7 +888,7 @@ def staff_performance_api():
         db.func.sum(Sale.profit).label('total_profit')
     ).outerjoin(Sale, db.and_(
         Sale.created_by == User.id,
-        db.func.date(Sale.created_at) == today
+        Sale.created_at >= start, Sale.created_at < end
     )).filter(
         User.role.in_(['staff', 'manager']),
         User.is_active == True
@@ -604,34 +906,45 @@ def staff_performance_api():
 @app.route('/api/activity-log')
 @owner_required
 def activity_log_api():
-    page = request.args.get('page', 1, type=int)
+    before_id = request.args.get('before_id', type=int)
     per_page = request.args.get('per_page', 50, type=int)
-    
-    activities = ActivityLog.query.order_by(ActivityLog.timestamp.desc()).paginate(
-        page=page, per_page=per_page, error_out=False
-    )
-    
-    return jsonify({
-        "items": [{
-            "id": a.id,
-            "user_name": a.user_name,
-            "action": a.action,
-            "entity_type": a.entity_type,
-            "entity_id": a.entity_id,
-            "details": a.details,
-            "timestamp": a.timestamp.isoformat()
-        } for a in activities.items],
-        "total": activities.total,
-        "pages": activities.pages,
-        "current_page": page
-    })
+
+    stmt = db.select(ActivityLog.id, ActivityLog.user_name, ActivityLog.action,
+                     ActivityLog.entity_type, ActivityLog.entity_id,
+                     ActivityLog.details, ActivityLog.timestamp)
+    if before_id:
+        stmt = stmt.where(ActivityLog.id < before_id)
+    stmt = stmt.order_by(ActivityLog.id.desc()).limit(per_page).execution_options(yield_per=500)
+
+    def generate():
+        yield b'{"items":['
+        first = True
+        last_id = None
+        with reports_engine().connect() as conn:
+            for r in conn.execute(stmt):
+                if not first:
+                    yield b','
+                first = False
+                last_id = r.id
+                yield orjson.dumps({
+                    "id": r.id,
+                    "user_name": r.user_name,
+                    "action": r.action,
+                    "entity_type": r.entity_type,
+                    "entity_id": r.entity_id,
+                    "details": r.details,
+                    "timestamp": r.timestamp
+                })
+        yield b'],"next_cursor":%b}' % (b'%d' % last_id if last_id is not None else b'null')
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
 
 # ==================== LEAD MANAGEMENT ====================
 
 @app.route('/leads/<int:lead_id>')
 @login_required
 def view_lead(lead_id):
-    lead = Lead.query.get_or_404(lead_id)
+    lead = Lead.query.options(db.undefer(Lead.notes)).get_or_404(lead_id)
     user = g.current_user
     if user.role == 'staff' and lead.created_by != user.id and lead.assigned_to != user.id:
         return render_template('error.html', message='Access denied'), 403
@@ -655,7 +968,7 @@ def update_lead(lead_id):
         lead.status = data.get('status')
         if lead.status == 'converted':
             lead.closed_by = user.id
-            lead.closed_at = datetime.utcnow()
+            lead.closed_at = datetime.now(timezone.utc)
     if data.get('notes'):
         lead.notes = data.get('notes')
     if 'follow_up_date' in (data if isinstance(data, dict) else data.to_dict()):
@@ -668,8 +981,8 @@ def update_lead(lead_id):
         lead.assigned_to = int(data.get('assigned_to'))
     
     lead.updated_by = user.id
-    lead.updated_at = datetime.utcnow()
-    lead.last_contact = datetime.utcnow()
+    lead.updated_at = datetime.now(timezone.utc)
+    lead.last_contact = datetime.now(timezone.utc)
     
     db.session.commit()
     log_activity('lead_updated', 'lead', lead.id, f'Lead {lead.lead_number} updated: {old_status} -> {lead.status}')
@@ -683,7 +996,8 @@ def update_lead(lead_id):
 def followups():
     user = g.current_user
     today = datetime.now()
-    
+    day_start, day_end = today_range()
+
     if user.can_view_all_leads():
         overdue = Lead.query.filter(
             Lead.follow_up_date < today,
@@ -691,10 +1005,11 @@ def followups():
         ).order_by(Lead.follow_up_date).all()
         
         today_followups = Lead.query.filter(
-            db.func.date(Lead.follow_up_date) == today.date(),
+            Lead.follow_up_date >= day_start,
+            Lead.follow_up_date < day_end,
             Lead.status.in_(['new', 'contacted', 'follow_up'])
         ).order_by(Lead.follow_up_date).all()
-        
+
         upcoming = Lead.query.filter(
             Lead.follow_up_date > today,
             Lead.follow_up_date <= today + timedelta(days=7),
@@ -708,7 +1023,8 @@ def followups():
         ).order_by(Lead.follow_up_date).all()
         
         today_followups = Lead.query.filter(
-            db.func.date(Lead.follow_up_date) == today.date(),
+            Lead.follow_up_date >= day_start,
+            Lead.follow_up_date < day_end,
             Lead.status.in_(['new', 'contacted', 'follow_up']),
             db.or_(Lead.created_by == user.id, Lead.assigned_to == user.id)
         ).order_by(Lead.follow_up_date).all()
@@ -739,9 +1055,7 @@ def deliveries_list():
 def add_delivery():
     if request.method == 'POST':
         data = request.form
-        count = Delivery.query.count()
         delivery = Delivery(
-            delivery_number=f"DL-{str(10001 + count).zfill(5)}",
             sale_id=data.get('sale_id') if data.get('sale_id') else None,
             customer_name=data.get('customer_name'),
             customer_phone=data.get('customer_phone'),
@@ -752,6 +1066,8 @@ def add_delivery():
             created_by=session.get('user_id')
         )
         db.session.add(delivery)
+        db.session.flush()
+        delivery.delivery_number = document_number('DL', delivery.id)
         db.session.commit()
         log_activity('delivery_created', 'delivery', delivery.id, f'Delivery {delivery.delivery_number} created')
         return redirect(url_for('deliveries_list'))
@@ -762,7 +1078,7 @@ def add_delivery():
 @app.route('/deliveries/<int:delivery_id>')
 @login_required
 def view_delivery(delivery_id):
-    delivery = Delivery.query.get_or_404(delivery_id)
+    delivery = Delivery.query.options(db.undefer(Delivery.notes)).get_or_404(delivery_id)
     user = g.current_user
     if user.role == 'staff' and delivery.created_by != user.id:
         return render_template('error.html', message='Access denied'), 403
@@ -784,7 +1100,7 @@ def update_delivery(delivery_id):
         delivery.status = data.get('status')
         if delivery.status == 'delivered':
             delivery.completed_by = user.id
-            delivery.completed_at = datetime.utcnow()
+            delivery.completed_at = datetime.now(timezone.utc)
     if data.get('notes'):
         delivery.notes = data.get('notes')
     if 'delivery_date' in (data if isinstance(data, dict) else data.to_dict()):
@@ -799,7 +1115,7 @@ def update_delivery(delivery_id):
         delivery.address = data.get('address')
     
     delivery.updated_by = user.id
-    delivery.updated_at = datetime.utcnow()
+    delivery.updated_at = datetime.now(timezone.utc)
     
     db.session.commit()
     log_activity('delivery_updated', 'delivery', delivery.id, f'Delivery {delivery.delivery_number}: {old_status} -> {delivery.status}')
@@ -1,9 +1,22 @@
+import re
+
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy.orm import deferred, validates
 from enum import Enum
 
 db = SQLAlchemy()
 
+def normalize_imei(value):
+    if value is None:
+        return None
+    text = str(value)
+    digits = re.sub(r'\D', '', text)
+    if not digits:
+        return None
+    if 14 <= len(digits) <= 16 or not re.search(r'[a-zA-Z]', text):
+        return int(digits)
+    return None
+
 class UserRole(Enum):
     OWNER = 'owner'
     MANAGER = 'manager'
@@ -13,7 +26,7 @@ class Brand(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), nullable=False, unique=True)
     is_active = db.Column(db.Boolean, default=True)
-    models = db.relationship('Model', backref='brand', lazy=True)
+    models = db.relationship('Model', backref='brand', lazy='selectin')
 
 class Model(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -21,7 +34,7 @@ class Model(db.Model):
     name = db.Column(db.String(50), nullable=False)
     order_index = db.Column(db.Integer, default=0)
     is_active = db.Column(db.Boolean, default=True)
-    storages = db.relationship('StorageOption', backref='model', lazy=True)
+    storages = db.relationship('StorageOption', backref='model', lazy='selectin')
 
 class StorageOption(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -30,15 +43,25 @@ class StorageOption(db.Model):
     is_active = db.Column(db.Boolean, default=True)
 
 class Product(db.Model):
+    __table_args__ = (
+        db.Index('ix_product_active', 'is_active', postgresql_where=db.text('is_active')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     category = db.Column(db.String(50))
-    price = db.Column(db.Float, default=0)
-    cost = db.Column(db.Float, default=0)
+    price = db.Column(db.Numeric(12, 2), default=0)
+    cost = db.Column(db.Numeric(12, 2), default=0)
     stock_quantity = db.Column(db.Integer, default=0)
-    images = db.Column(db.String(500))
     is_preloaded = db.Column(db.Boolean, default=True)
     is_active = db.Column(db.Boolean, default=True)
+    images = db.relationship('ProductImage', backref='product', lazy='selectin',
+                             order_by='ProductImage.order_index')
+
+class ProductImage(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=False, index=True)
+    path = db.Column(db.String(255), nullable=False)
+    order_index = db.Column(db.Integer, default=0)
 
 class Device(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -47,40 +70,52 @@ class Device(db.Model):
     storage = db.Column(db.String(50))
     color = db.Column(db.String(30))
     imei_or_serial = db.Column(db.String(100), unique=True)
-    status = db.Column(db.String(50), default='available')
-    photos = db.Column(db.String(500))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    imei_norm = db.Column(db.BigInteger, unique=True, index=True)
+    status = db.Column(db.Enum('available', 'reserved', 'sold', 'returned', name='device_status'), default='available', index=True)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
     created_by = db.Column(db.String(50))
 
+    @validates('imei_or_serial')
+    def _set_imei_norm(self, _key, value):
+        self.imei_norm = normalize_imei(value)
+        return value
+
 class Customer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
     phone = db.Column(db.String(20))
     email = db.Column(db.String(100))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
     created_by = db.Column(db.String(50))
 
 class Lead(db.Model):
+    __table_args__ = (
+        db.Index('ix_lead_status_open', 'status', postgresql_where=db.text("status IN ('new', 'contacted', 'follow_up')")),
+        db.Index('ix_lead_status_assigned', 'status', 'assigned_to'),
+        db.Index('ix_lead_open_assigned', 'assigned_to', postgresql_where=db.text("status IN ('new', 'contacted', 'follow_up')")),
+    )
     id = db.Column(db.Integer, primary_key=True)
     lead_number = db.Column(db.String(20), unique=True)
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), index=True)
     customer_name = db.Column(db.String(100), nullable=False)
     customer_phone = db.Column(db.String(20), nullable=False)
     customer_email = db.Column(db.String(100))
     interest = db.Column(db.String(200))
     source = db.Column(db.String(50))
-    status = db.Column(db.String(30), default='new')
-    notes = db.Column(db.Text)
-    assigned_to = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    updated_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    closed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
-    closed_at = db.Column(db.DateTime)
-    follow_up_date = db.Column(db.DateTime)
-    last_contact = db.Column(db.DateTime)
+    status = db.Column(db.Enum('new', 'contacted', 'follow_up', 'converted', 'lost', name='lead_status'), default='new')
+    notes = deferred(db.Column(db.Text))
+    assigned_to = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), index=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), index=True)
+    updated_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    closed_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), index=True)
+    updated_at = db.Column(db.DateTime(timezone=True), onupdate=db.func.now())
+    closed_at = db.Column(db.DateTime(timezone=True))
+    follow_up_date = db.Column(db.DateTime(timezone=True), index=True)
+    last_contact = db.Column(db.DateTime(timezone=True))
 
 class Sale(db.Model):
+    __table_args__ = (db.Index('ix_sale_created_by_created_at', 'created_by', 'created_at'),)
     id = db.Column(db.Integer, primary_key=True)
     sale_number = db.Column(db.String(20), unique=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'), nullable=True)
@@ -89,16 +124,21 @@ class Sale(db.Model):
     lead_id = db.Column(db.Integer, db.ForeignKey('lead.id'), nullable=True)
     other_product_name = db.Column(db.String(100))
     quantity = db.Column(db.Integer, default=1)
-    unit_price = db.Column(db.Float, default=0)
-    cost_price = db.Column(db.Float, default=0)
-    total_price = db.Column(db.Float, default=0)
-    profit = db.Column(db.Float, default=0)
+    unit_price = db.Column(db.Numeric(12, 2), default=0)
+    cost_price = db.Column(db.Numeric(12, 2), default=0)
+    total_price = db.Column(db.Numeric(12, 2), db.Computed('quantity * unit_price', persisted=True))
+    profit = db.Column(db.Numeric(12, 2), db.Computed(
+        'CASE WHEN cost_price != 0 THEN quantity * (unit_price - cost_price) ELSE 0 END',
+        persisted=True
+    ))
     payment_method = db.Column(db.String(20))
-    payment_status = db.Column(db.String(20), default='completed')
-    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    updated_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
+    payment_status = db.Column(db.Enum('pending', 'completed', 'refunded', name='payment_status'), default='completed')
+    product = db.relationship('Product', lazy='selectin')
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    updated_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    creator = db.relationship('User', foreign_keys=[created_by], lazy='selectin')
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), index=True)
+    updated_at = db.Column(db.DateTime(timezone=True), onupdate=db.func.now())
 
 class TradeIn(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -107,115 +147,156 @@ class TradeIn(db.Model):
     model = db.Column(db.String(50), nullable=False)
     storage = db.Column(db.String(50))
     color = db.Column(db.String(30))
-    imei = db.Column(db.String(20))
+    imei = db.Column(db.String(20), index=True)
+    imei_norm = db.Column(db.BigInteger, index=True)
     serial_number = db.Column(db.String(50))
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), index=True)
     customer_name = db.Column(db.String(100), nullable=False)
     customer_phone = db.Column(db.String(20), nullable=False)
     customer_email = db.Column(db.String(100))
-    base_value = db.Column(db.Float, default=0)
+    base_value = db.Column(db.Numeric(12, 2), default=0)
     condition_score = db.Column(db.Integer, default=100)
-    calculated_offer = db.Column(db.Float, default=0)
-    final_offer = db.Column(db.Float)
-    status = db.Column(db.String(20), default='pending')
+    calculated_offer = db.Column(db.Numeric(12, 2), default=0)
+    final_offer = db.Column(db.Numeric(12, 2))
+    status = db.Column(db.Enum('pending', 'approved', 'rejected', 'completed', name='tradein_status'), default='pending', index=True)
     payout_method = db.Column(db.String(20))
-    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    updated_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    reviewed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
-    reviewed_at = db.Column(db.DateTime)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), index=True)
+    updated_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    reviewed_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(timezone=True), onupdate=db.func.now())
+    reviewed_at = db.Column(db.DateTime(timezone=True))
+
+    @validates('imei')
+    def _set_imei_norm(self, _key, value):
+        self.imei_norm = normalize_imei(value)
+        return value
 
 class Repair(db.Model):
+    __table_args__ = (
+        db.Index('ix_repair_status_open', 'status', postgresql_where=db.text("status != 'completed'")),
+        db.Index('ix_repair_open_assigned', 'assigned_to', postgresql_where=db.text("status != 'completed'")),
+    )
     id = db.Column(db.Integer, primary_key=True)
     repair_number = db.Column(db.String(20), unique=True)
     device_brand = db.Column(db.String(50), nullable=False)
     device_model = db.Column(db.String(50), nullable=False)
     device_serial = db.Column(db.String(100))
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), index=True)
     customer_name = db.Column(db.String(100), nullable=False)
     customer_phone = db.Column(db.String(20), nullable=False)
-    issue_description = db.Column(db.Text)
-    diagnosis = db.Column(db.Text)
-    repair_cost = db.Column(db.Float, default=0)
-    parts_cost = db.Column(db.Float, default=0)
-    total_cost = db.Column(db.Float, default=0)
-    status = db.Column(db.String(30), default='received')
-    assigned_to = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    updated_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    completed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
-    completed_at = db.Column(db.DateTime)
+    issue_description = deferred(db.Column(db.Text))
+    diagnosis = deferred(db.Column(db.Text))
+    repair_cost = db.Column(db.Numeric(12, 2), default=0)
+    parts_cost = db.Column(db.Numeric(12, 2), default=0)
+    total_cost = db.Column(db.Numeric(12, 2), db.Computed('repair_cost + parts_cost', persisted=True))
+    status = db.Column(db.Enum('received', 'in_progress', 'completed', name='repair_status'), default='received')
+    assigned_to = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), index=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), index=True)
+    updated_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    completed_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(timezone=True), onupdate=db.func.now())
+    completed_at = db.Column(db.DateTime(timezone=True))
 
 class Delivery(db.Model):
+    __table_args__ = (
+        db.Index('ix_delivery_status_open', 'status', postgresql_where=db.text("status != 'completed'")),
+        db.Index('ix_delivery_open_assigned', 'assigned_to', postgresql_where=db.text("status IN ('pending', 'in_transit')")),
+    )
     id = db.Column(db.Integer, primary_key=True)
     delivery_number = db.Column(db.String(20), unique=True)
     sale_id = db.Column(db.Integer, db.ForeignKey('sale.id'))
+    customer_id = db.Column(db.Integer, db.ForeignKey('customer.id'), index=True)
     customer_name = db.Column(db.String(100), nullable=False)
     customer_phone = db.Column(db.String(20), nullable=False)
     address = db.Column(db.Text)
-    delivery_date = db.Column(db.DateTime)
-    status = db.Column(db.String(30), default='pending')
-    notes = db.Column(db.Text)
-    assigned_to = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    updated_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    completed_by = db.Column(db.Integer, db.ForeignKey('user.id'))
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    updated_at = db.Column(db.DateTime, onupdate=datetime.utcnow)
-    completed_at = db.Column(db.DateTime)
+    delivery_date = db.Column(db.DateTime(timezone=True))
+    status = db.Column(db.Enum('pending', 'in_transit', 'delivered', 'failed', 'completed', name='delivery_status'), default='pending')
+    notes = deferred(db.Column(db.Text))
+    assigned_to = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'), index=True)
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    updated_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    completed_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+    updated_at = db.Column(db.DateTime(timezone=True), onupdate=db.func.now())
+    completed_at = db.Column(db.DateTime(timezone=True))
+
+PERM_VIEW_ALL_LEADS = 1 << 0
+PERM_ASSIGN_LEADS = 1 << 1
+PERM_DELETE_RECORDS = 1 << 2
+PERM_VIEW_PROFITS = 1 << 3
+PERM_VIEW_STAFF_METRICS = 1 << 4
+PERM_MANAGE_STAFF = 1 << 5
+PERM_VIEW_ALL_DELIVERIES = 1 << 6
+PERM_ACCESS_SETTINGS = 1 << 7
+
+_MANAGER_PERMS = (PERM_VIEW_ALL_LEADS | PERM_ASSIGN_LEADS |
+                  PERM_VIEW_STAFF_METRICS | PERM_VIEW_ALL_DELIVERIES)
+_OWNER_PERMS = (_MANAGER_PERMS | PERM_DELETE_RECORDS | PERM_VIEW_PROFITS |
+                PERM_MANAGE_STAFF | PERM_ACCESS_SETTINGS)
+
+ROLE_PERMS = {'owner': _OWNER_PERMS, 'manager': _MANAGER_PERMS, 'staff': 0}
+
+MANAGER_ROLES = frozenset({'owner', 'manager'})
 
 class User(db.Model):
+    __table_args__ = (db.Index('ix_user_username_active', 'username', 'is_active'),)
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(50), unique=True, nullable=False)
-    password_hash = db.Column(db.String(128), nullable=False)
+    password_hash = db.Column(db.String(255), nullable=False)
     pin = db.Column(db.String(10))
     name = db.Column(db.String(100))
     phone = db.Column(db.String(20))
-    role = db.Column(db.String(20), default='staff')
+    role = db.Column(db.Enum('owner', 'manager', 'staff', name='user_role'), default='staff')
     is_active = db.Column(db.Boolean, default=True)
-    last_activity = db.Column(db.DateTime)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    last_activity = db.Column(db.DateTime(timezone=True))
+    created_at = db.Column(db.DateTime(timezone=True), server_default=db.func.now())
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
     
+    @property
+    def _perms(self):
+        return ROLE_PERMS.get(self.role, 0)
+
     def can_view_all_leads(self):
-        return self.role in ['owner', 'manager']
-    
+        return bool(self._perms & PERM_VIEW_ALL_LEADS)
+
     def can_assign_leads(self):
-        return self.role in ['owner', 'manager']
-    
+        return bool(self._perms & PERM_ASSIGN_LEADS)
+
     def can_delete_records(self):
-        return self.role == 'owner'
-    
+        return bool(self._perms & PERM_DELETE_RECORDS)
+
     def can_view_profits(self):
-        return self.role == 'owner'
-    
+        return bool(self._perms & PERM_VIEW_PROFITS)
+
     def can_view_staff_metrics(self):
-        return self.role in ['owner', 'manager']
-    
+        return bool(self._perms & PERM_VIEW_STAFF_METRICS)
+
     def can_manage_staff(self):
-        return self.role == 'owner'
-    
+        return bool(self._perms & PERM_MANAGE_STAFF)
+
     def can_view_all_deliveries(self):
-        return self.role in ['owner', 'manager']
-    
+        return bool(self._perms & PERM_VIEW_ALL_DELIVERIES)
+
     def can_access_settings(self):
-        return self.role == 'owner'
+        return bool(self._perms & PERM_ACCESS_SETTINGS)
 
 class ActivityLog(db.Model):
+    __table_args__ = (db.Index('ix_activity_user_time', 'user_id', 'timestamp'),)
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id', ondelete='SET NULL'))
     user_name = db.Column(db.String(100))
     action = db.Column(db.String(100), nullable=False)
     entity_type = db.Column(db.String(50))
     entity_id = db.Column(db.Integer)
-    details = db.Column(db.Text)
+    details = deferred(db.Column(db.Text))
     ip_address = db.Column(db.String(50))
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), index=True)
 
 class AuditLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user = db.Column(db.String(50))
     action = db.Column(db.String(100), nullable=False)
-    details = db.Column(db.Text)
-    timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+    details = deferred(db.Column(db.Text))
+    timestamp = db.Column(db.DateTime(timezone=True), server_default=db.func.now(), index=True)
@@ -1,9 +1,22 @@
 #!/usr/bin/env python
 import os
 import sys
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'phone_shop_system'))
-os.chdir(os.path.join(os.path.dirname(__file__), 'phone_shop_system'))
-from main import app
+
+BASE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'phone_shop_system')
+sys.path.insert(0, BASE_DIR)
+os.chdir(BASE_DIR)
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=True)
+    if os.environ.get('FLASK_ENV') == 'development':
+        from main import app
+        app.run(host='0.0.0.0', port=5000, debug=True)
+    else:
+        workers = int(os.environ.get('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1) + 1))
+        os.execvp('gunicorn', [
+            'gunicorn',
+            '-w', str(workers),
+            '-k', 'gthread',
+            '--threads', '8',
+            '-b', '0.0.0.0:5000',
+            'main:app'
+        ])